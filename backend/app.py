@@ -2,16 +2,20 @@ from flask import Flask, jsonify, send_from_directory, request, send_file
 from flask_cors import CORS
 import os
 import json
-import re
 import sqlite3
+import struct
+import tempfile
 from datetime import datetime
 from PIL import Image
 import threading
-from io import BytesIO
-from collections import OrderedDict
+from queue import SimpleQueue, Empty
 import time
+import atexit
+import orjson
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import PatternMatchingEventHandler
 
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:5173', 'http://localhost:3000'])
@@ -19,53 +23,99 @@ CORS(app, origins=['http://localhost:5173', 'http://localhost:3000'])
 # Path to the images directory
 IMAGE_DIR = 'images'
 PREVIEW_DIR = 'image_previews'
-VIEW_DATA_FILE = 'view_data.json'
+LEVELS_DIR = 'image_levels'
+WEBP_DIR = 'image_webp'
+VIEW_DATA_FILE = 'view_data.jsonl'
 DB_FILE = 'tiles.db'
 
-# Connection pool for database
+# Browser cache lifetime for tiles (one year)
+TILE_MAX_AGE = 31536000
+
+# Number of downsampled levels generated below each high-res tile (each halves the size)
+PYRAMID_LEVELS = 3
+
+# Bump when derived tile assets change (levels, WebP) so existing databases
+# are backfilled by the background pass on the next start
+DERIVE_VERSION = 2
+
+# Request threads per worker; the Dockerfile passes the same value to gunicorn --threads
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 16))
+
+# Connection pools for database (read-only for request handlers, read-write for the scanner/watcher);
+# the read-only pool keeps one connection per request thread so none churn under load
 DB_POOL_SIZE = 5
-_db_pool = []
+DB_RO_POOL_SIZE = max(DB_POOL_SIZE, WEB_THREADS)
+_db_pool_ro = []
+_db_pool_rw = []
 _db_pool_lock = threading.Lock()
 
 # Metadata cache
 _meta_cache = None
 
-# LRU cache for frequently accessed tiles (stores image data)
+# Encoded view-data lines waiting for the background writer
+_view_q = SimpleQueue()
+
+# Watcher tile updates waiting for the database writer, committed in batches
+TILE_WRITE_BATCH_SIZE = 100
+TILE_WRITE_BATCH_SECONDS = 0.2
+_tile_write_q = SimpleQueue()
+
+# LRU cache for frequently accessed tiles (stores filepath and extension)
 class LRUCache:
-    def __init__(self, capacity=100):
-        self.cache = OrderedDict()
-        self.capacity = capacity
-        self.lock = threading.Lock()
+    """LRU cache split into independently locked shards to cut lock contention"""
+
+    def __init__(self, capacity=100, shards=16):
+        self.shards = [(OrderedDict(), threading.Lock()) for _ in range(shards)]
+        self.capacity_per_shard = max(1, capacity // shards)
+
+    def _shard(self, key):
+        return self.shards[hash(key) % len(self.shards)]
 
     def get(self, key):
-        with self.lock:
-            if key not in self.cache:
+        cache, lock = self._shard(key)
+        with lock:
+            if key not in cache:
                 return None
-            self.cache.move_to_end(key)
-            return self.cache[key]
+            cache.move_to_end(key)
+            return cache[key]
 
     def put(self, key, value):
-        with self.lock:
-            if key in self.cache:
-                self.cache.move_to_end(key)
-            self.cache[key] = value
-            if len(self.cache) > self.capacity:
-                self.cache.popitem(last=False)
+        cache, lock = self._shard(key)
+        with lock:
+            if key in cache:
+                cache.move_to_end(key)
+            cache[key] = value
+            if len(cache) > self.capacity_per_shard:
+                cache.popitem(last=False)
+
+    def invalidate(self, key):
+        cache, lock = self._shard(key)
+        with lock:
+            cache.pop(key, None)
 
 tile_cache = LRUCache(capacity=200)
 
 # Database connection pool management
-def get_db_connection():
-    """Get a database connection from the pool"""
+def get_db_connection(readonly=False):
+    """Get a database connection from the pool (read-only pool for request handlers)"""
+    pool = _db_pool_ro if readonly else _db_pool_rw
     with _db_pool_lock:
-        if _db_pool:
-            return _db_pool.pop()
+        if pool:
+            return pool.pop()
+
+    if readonly:
+        # Read-only URI connection; WAL lets it read alongside the writer
+        conn = sqlite3.connect(f'file:{DB_FILE}?mode=ro', uri=True, check_same_thread=False, timeout=30.0)
+        conn.execute('PRAGMA query_only=1')
+    else:
+        # Create new connection with optimizations
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False, timeout=30.0)
 
-    # Create new connection with optimizations
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False, timeout=30.0)
+        # Enable WAL mode for better concurrent access
+        conn.execute('PRAGMA journal_mode=WAL')
 
-    # Enable WAL mode for better concurrent access
-    conn.execute('PRAGMA journal_mode=WAL')
+        # Optimize for speed
+        conn.execute('PRAGMA synchronous=NORMAL')
 
     # Increase cache size (10MB)
     conn.execute('PRAGMA cache_size=-10000')
@@ -73,27 +123,53 @@ def get_db_connection():
     # Use memory for temp storage
     conn.execute('PRAGMA temp_store=MEMORY')
 
-    # Optimize for speed
-    conn.execute('PRAGMA synchronous=NORMAL')
     conn.execute('PRAGMA mmap_size=268435456')  # 256MB memory map
 
     return conn
 
-def release_db_connection(conn):
-    """Return a connection to the pool"""
+def release_db_connection(conn, readonly=False):
+    """Return a connection to the pool it came from"""
+    pool = _db_pool_ro if readonly else _db_pool_rw
     with _db_pool_lock:
-        if len(_db_pool) < DB_POOL_SIZE:
-            _db_pool.append(conn)
+        if len(pool) < (DB_RO_POOL_SIZE if readonly else DB_POOL_SIZE):
+            pool.append(conn)
         else:
             conn.close()
 
+# Tile filenames look like r{row}_c{col}.{ext} or r{row}_c{col}_preview.{ext}
+TILE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'webp')
+PREVIEW_SUFFIX = '_preview'
+
+def parse_tile_filename(filename, is_preview):
+    """Parse a tile filename into (row, col, ext), or None if it doesn't match"""
+    stem, dot, ext = filename.rpartition('.')
+    ext = ext.lower()
+    if not dot or ext not in TILE_EXTENSIONS:
+        return None
+
+    if is_preview:
+        if stem[-len(PREVIEW_SUFFIX):].lower() != PREVIEW_SUFFIX:
+            return None
+        stem = stem[:-len(PREVIEW_SUFFIX)]
+
+    if stem[:1] not in ('r', 'R'):
+        return None
+    row, sep, col = stem[1:].partition('_')
+    if not sep or col[:1] not in ('c', 'C'):
+        return None
+    col = col[1:]
+    if not (row.isdecimal() and col.isdecimal()):
+        return None
+
+    return int(row), int(col), ext
+
 # Initialize database
 def init_db():
     """Initialize SQLite database with tile metadata"""
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # Create tiles table with BLOB storage for images
+    # Create tiles table; image bytes stay on disk and are served by filepath
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS tiles (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -104,15 +180,47 @@ def init_db():
             width INTEGER,
             height INTEGER,
             filepath TEXT NOT NULL,
-            image_data BLOB,
+            webp_filepath TEXT,
             UNIQUE(row, col, is_preview)
         )
     ''')
 
+    # Add WebP column to databases created before it existed
+    cursor.execute('PRAGMA table_info(tiles)')
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'webp_filepath' not in columns:
+        cursor.execute('ALTER TABLE tiles ADD COLUMN webp_filepath TEXT')
+
+    # Databases from before tiles were served from disk still carry a copy of
+    # every image; drop it once and reclaim the space
+    if 'image_data' in columns:
+        try:
+            cursor.execute('ALTER TABLE tiles DROP COLUMN image_data')
+        except sqlite3.OperationalError:
+            # SQLite older than 3.35 has no DROP COLUMN; empty the column instead
+            cursor.execute('UPDATE tiles SET image_data = NULL')
+        conn.commit()
+        cursor.execute('VACUUM')
+        print("✓ Removed stored tile images from the database")
+
     # Create indexes for fast lookups
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_tiles_row_col ON tiles(row, col)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_tiles_preview ON tiles(is_preview)')
 
+    # Create pyramid table for downsampled copies of high-res tiles
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tile_levels (
+            level INTEGER NOT NULL,
+            row INTEGER NOT NULL,
+            col INTEGER NOT NULL,
+            extension TEXT NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            filepath TEXT NOT NULL,
+            UNIQUE(level, row, col)
+        )
+    ''')
+
     # Create metadata table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS metadata (
@@ -124,6 +232,215 @@ def init_db():
     conn.commit()
     release_db_connection(conn)
 
+def build_tiles_meta(cursor):
+    """Compute the /api/tiles/meta response from the tiles and metadata tables"""
+    # Get tile dimensions from metadata
+    cursor.execute('''
+        SELECT key, value FROM metadata
+        WHERE key IN ('tile_width', 'tile_height', 'preview_width', 'preview_height', 'tile_version')
+    ''')
+    values = dict(cursor.fetchall())
+    tile_width = int(values['tile_width'])
+    tile_height = int(values['tile_height'])
+    preview_width = int(values.get('preview_width', 128))
+    preview_height = int(values.get('preview_height', 128))
+
+    # Get row/col ranges and unique extensions for high-res tiles
+    cursor.execute('''
+        SELECT MIN(row), MAX(row), MIN(col), MAX(col), GROUP_CONCAT(DISTINCT extension)
+        FROM tiles WHERE is_preview = 0
+    ''')
+    min_row, max_row, min_col, max_col, extensions = cursor.fetchone()
+    if min_row is None:
+        return None  # No high-res tiles yet
+    extensions = extensions.split(',') if extensions else []
+
+    # Check if preview tiles exist and get their extensions
+    cursor.execute('''
+        SELECT COUNT(*), GROUP_CONCAT(DISTINCT extension)
+        FROM tiles WHERE is_preview = 1
+    ''')
+    preview_count, preview_extensions = cursor.fetchone()
+    has_preview = preview_count > 0
+    preview_extensions = preview_extensions.split(',') if preview_extensions else []
+
+    # Get deepest generated pyramid level
+    cursor.execute("SELECT MAX(level) FROM tile_levels")
+    max_level = cursor.fetchone()[0] or 0
+
+    # Calculate center
+    center_row = (min_row + max_row) // 2
+    center_col = (min_col + max_col) // 2
+
+    return {
+        'minRow': min_row,
+        'maxRow': max_row,
+        'minCol': min_col,
+        'maxCol': max_col,
+        'tileWidth': tile_width,
+        'tileHeight': tile_height,
+        'extensions': extensions,
+        'centerRow': center_row,
+        'centerCol': center_col,
+        'hasPreview': has_preview,
+        'previewWidth': preview_width,
+        'previewHeight': preview_height,
+        'previewExtensions': preview_extensions,
+        'maxLevel': max_level,
+        'tileVersion': values.get('tile_version', '0')
+    }
+
+def bump_tile_version(cursor):
+    """Record a tile content change; clients append the version to tile URLs"""
+    # Tiles are served immutable, so a rewritten tile must reach clients
+    # under a new URL rather than through revalidation
+    cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('tile_version', ?)", (str(time.time_ns()),))
+
+def store_tiles_meta(cursor):
+    """Recompute the metadata response and persist it as a single JSON row"""
+    meta = build_tiles_meta(cursor)
+    if meta is not None:
+        cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('meta_json', ?)", (json.dumps(meta),))
+    return meta
+
+def scan_tile_dir(directory, is_preview):
+    """List (row, col, ext, filepath) for every tile file in a directory"""
+    tiles = []
+    if not os.path.exists(directory):
+        return tiles
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            parsed = parse_tile_filename(entry.name, is_preview)
+            if parsed:
+                tiles.append((*parsed, entry.path))
+    return tiles
+
+# JPEG start-of-frame markers carry the image dimensions (DHT, JPG and DAC share the range)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def read_image_size(filepath, ext):
+    """Read (width, height) from a PNG, JPEG or WebP header without decoding"""
+    with open(filepath, 'rb') as f:
+        if ext == 'png':
+            header = f.read(24)
+            if header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+                raise ValueError('Not a PNG file')
+            return struct.unpack('>II', header[16:24])
+
+        if ext == 'webp':
+            header = f.read(30)
+            if header[:4] != b'RIFF' or header[8:12] != b'WEBP':
+                raise ValueError('Not a WebP file')
+            chunk = header[12:16]
+            if chunk == b'VP8 ':
+                # Lossy: 14-bit dimensions after the frame tag and start code
+                width, height = struct.unpack('<HH', header[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b'VP8L':
+                # Lossless: 14-bit (width - 1) and (height - 1) after the signature byte
+                bits = int.from_bytes(header[21:25], 'little')
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b'VP8X':
+                # Extended: 24-bit (width - 1) and (height - 1) canvas size
+                return int.from_bytes(header[24:27], 'little') + 1, int.from_bytes(header[27:30], 'little') + 1
+            raise ValueError('Unknown WebP chunk')
+
+        if ext in ('jpg', 'jpeg'):
+            if f.read(2) != b'\xff\xd8':
+                raise ValueError('Not a JPEG file')
+            # Walk the marker segments until the start-of-frame
+            while True:
+                marker = f.read(1)
+                while marker == b'\xff':
+                    marker = f.read(1)
+                if not marker:
+                    raise ValueError('No JPEG frame header')
+                code = marker[0]
+                if code == 0x01 or 0xD0 <= code <= 0xD7 or code == 0x00:
+                    continue  # Standalone markers and stuffed bytes have no length
+                length = struct.unpack('>H', f.read(2))[0]
+                if code in JPEG_SOF_MARKERS:
+                    height, width = struct.unpack('>xHH', f.read(5))
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+
+    raise ValueError(f'Unsupported tile extension: {ext}')
+
+def probe_tile_size(filepath, ext):
+    """Read (width, height) from an image header, or None if unreadable"""
+    try:
+        return read_image_size(filepath, ext)
+    except Exception:
+        return None
+
+def is_up_to_date(target, source_mtime_ns):
+    """True if a derived file exists and carries its source's exact mtime"""
+    # Equality rather than "newer than": rsync -a / cp -p replace tiles while
+    # keeping an older mtime, which a newer-than check would never notice
+    try:
+        return os.stat(target).st_mtime_ns == source_mtime_ns
+    except FileNotFoundError:
+        return False
+
+def save_image_atomic(img, path, source_mtime_ns, format=None, **params):
+    """Save an image via a temp file and rename, so a killed process never leaves a torn file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, format or Image.registered_extensions()[os.path.splitext(path)[1].lower()], **params)
+        # Stamp the source's mtime so is_up_to_date can match it exactly
+        os.utime(tmp_path, ns=(source_mtime_ns, source_mtime_ns))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def generate_tile_levels(row, col, ext, filepath):
+    """Write downsampled copies of a high-res tile, one per pyramid level"""
+    levels = []
+    img = None
+    try:
+        # Level sizes come from the header; pixels are only decoded if a level is stale
+        source_mtime_ns = os.stat(filepath).st_mtime_ns
+        width, height = read_image_size(filepath, ext)
+        for level in range(1, PYRAMID_LEVELS + 1):
+            level_width, level_height = width >> level, height >> level
+            if level_width < 1 or level_height < 1:
+                break
+
+            level_dir = os.path.join(LEVELS_DIR, str(level))
+            level_path = os.path.join(level_dir, os.path.basename(filepath))
+
+            if not is_up_to_date(level_path, source_mtime_ns):
+                if img is None:
+                    img = Image.open(filepath)
+                os.makedirs(level_dir, exist_ok=True)
+                save_image_atomic(img.resize((level_width, level_height), Image.BILINEAR), level_path, source_mtime_ns)
+            levels.append((level, row, col, ext, level_width, level_height, level_path))
+    except Exception as e:
+        print(f"✗ Error generating levels for {os.path.basename(filepath)}: {e}")
+    finally:
+        if img is not None:
+            img.close()
+    return levels
+
+def generate_webp(filepath):
+    """Re-encode a PNG tile as WebP, returning the new path or None"""
+    try:
+        webp_path = os.path.join(WEBP_DIR, os.path.splitext(os.path.basename(filepath))[0] + '.webp')
+        source_mtime_ns = os.stat(filepath).st_mtime_ns
+        if is_up_to_date(webp_path, source_mtime_ns):
+            return webp_path
+
+        os.makedirs(WEBP_DIR, exist_ok=True)
+        with Image.open(filepath) as img:
+            save_image_atomic(img, webp_path, source_mtime_ns, 'WEBP', quality=85, method=4)
+        return webp_path
+    except Exception as e:
+        print(f"✗ Error encoding WebP for {os.path.basename(filepath)}: {e}")
+        return None
+
 def scan_and_cache_tiles():
     """Scan tile directories and cache metadata in database"""
     conn = get_db_connection()
@@ -133,81 +450,41 @@ def scan_and_cache_tiles():
     cursor.execute("SELECT value FROM metadata WHERE key = 'scanned'")
     result = cursor.fetchone()
     if result and result[0] == 'true':
-        conn.close()
+        release_db_connection(conn)
         return  # Already scanned
 
-    tile_pattern = re.compile(r'^r(\d+)_c(\d+)\.(png|jpg|jpeg|webp)$', re.IGNORECASE)
-    preview_pattern = re.compile(r'^r(\d+)_c(\d+)_preview\.(png|jpg|jpeg|webp)$', re.IGNORECASE)
-
-    tile_width = None
-    tile_height = None
-    preview_width = None
-    preview_height = None
-
-    # Scan high-res tiles
-    if os.path.exists(IMAGE_DIR):
-        for filename in os.listdir(IMAGE_DIR):
-            match = tile_pattern.match(filename)
-            if match:
-                row = int(match.group(1))
-                col = int(match.group(2))
-                ext = match.group(3).lower()
-                filepath = os.path.join(IMAGE_DIR, filename)
-
-                # Get dimensions from first tile only
-                width, height = None, None
-                if tile_width is None:
-                    try:
-                        with Image.open(filepath) as img:
-                            tile_width, tile_height = img.size
-                            width, height = tile_width, tile_height
-                    except Exception:
-                        tile_width, tile_height = 256, 256
-                else:
-                    width, height = tile_width, tile_height
-
-                # Read image data into memory
-                with open(filepath, 'rb') as f:
-                    image_data = f.read()
-
-                # Insert into database with image BLOB
-                cursor.execute('''
-                    INSERT OR REPLACE INTO tiles (row, col, extension, is_preview, width, height, filepath, image_data)
-                    VALUES (?, ?, ?, 0, ?, ?, ?, ?)
-                ''', (row, col, ext, width, height, filepath, image_data))
-
-    # Scan preview tiles
-    if os.path.exists(PREVIEW_DIR):
-        for filename in os.listdir(PREVIEW_DIR):
-            match = preview_pattern.match(filename)
-            if match:
-                row = int(match.group(1))
-                col = int(match.group(2))
-                ext = match.group(3).lower()
-                filepath = os.path.join(PREVIEW_DIR, filename)
-
-                # Get dimensions from first preview only
-                width, height = None, None
-                if preview_width is None:
-                    try:
-                        with Image.open(filepath) as img:
-                            preview_width, preview_height = img.size
-                            width, height = preview_width, preview_height
-                    except Exception:
-                        preview_width = (tile_width or 256) // 2
-                        preview_height = (tile_height or 256) // 2
-                else:
-                    width, height = preview_width, preview_height
-
-                # Read preview image data into memory
-                with open(filepath, 'rb') as f:
-                    image_data = f.read()
-
-                # Insert into database with image BLOB
-                cursor.execute('''
-                    INSERT OR REPLACE INTO tiles (row, col, extension, is_preview, width, height, filepath, image_data)
-                    VALUES (?, ?, ?, 1, ?, ?, ?, ?)
-                ''', (row, col, ext, width, height, filepath, image_data))
+    # Walk both tile directories concurrently so their directory I/O overlaps
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        tiles_future = executor.submit(scan_tile_dir, IMAGE_DIR, False)
+        previews_future = executor.submit(scan_tile_dir, PREVIEW_DIR, True)
+        tiles = tiles_future.result()
+        previews = previews_future.result()
+
+    # Get dimensions from first tile of each kind only
+    tile_width, tile_height = None, None
+    if tiles:
+        tile_width, tile_height = probe_tile_size(tiles[0][3], tiles[0][2]) or (256, 256)
+
+    preview_width, preview_height = None, None
+    if previews:
+        preview_width, preview_height = probe_tile_size(previews[0][3], previews[0][2]) or (
+            (tile_width or 256) // 2, (tile_height or 256) // 2)
+
+    # Tile rows inserted in one batch; levels and WebP copies are derived
+    # afterwards in the background so startup only pays for the directory walk
+    rows = [(row, col, ext, 0, tile_width, tile_height, filepath, None) for row, col, ext, filepath in tiles]
+    rows += [(row, col, ext, 1, preview_width, preview_height, filepath, None) for row, col, ext, filepath in previews]
+
+    # Relax durability for the one-off bulk import; restored after commit
+    cursor.execute('PRAGMA synchronous=OFF')
+    cursor.execute('PRAGMA journal_mode=MEMORY')
+
+    # Insert all tile metadata in a single transaction with one prepared statement
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.executemany('''
+        INSERT OR REPLACE INTO tiles (row, col, extension, is_preview, width, height, filepath, webp_filepath)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
 
     # Store metadata
     cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('tile_width', ?)", (str(tile_width or 256),))
@@ -215,91 +492,167 @@ def scan_and_cache_tiles():
     cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('preview_width', ?)", (str(preview_width or 128),))
     cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('preview_height', ?)", (str(preview_height or 128),))
     cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('scanned', 'true')")
+    bump_tile_version(cursor)
 
-    conn.commit()
-    release_db_connection(conn)
+    # Precompute the metadata response so the endpoint is a single lookup
+    store_tiles_meta(cursor)
 
-# File watcher for automatic tile updates
-class TileFileHandler(FileSystemEventHandler):
-    """Watch for new or modified tiles and update database"""
-
-    def __init__(self):
-        self.tile_pattern = re.compile(r'^r(\d+)_c(\d+)\.(png|jpg|jpeg|webp)$', re.IGNORECASE)
-        self.preview_pattern = re.compile(r'^r(\d+)_c(\d+)_preview\.(png|jpg|jpeg|webp)$', re.IGNORECASE)
-        self.processing = set()
-        self.lock = threading.Lock()
-
-    def process_tile(self, filepath, is_preview):
-        """Process a single tile file and add/update in database"""
-        filename = os.path.basename(filepath)
-
-        # Prevent duplicate processing
-        with self.lock:
-            if filepath in self.processing:
-                return
-            self.processing.add(filepath)
+    conn.commit()
 
-        try:
-            pattern = self.preview_pattern if is_preview else self.tile_pattern
-            match = pattern.match(filename)
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    release_db_connection(conn)
 
-            if not match:
-                return
+# Tiles derived per transaction by the background pass
+DERIVE_BATCH_SIZE = 500
 
-            row = int(match.group(1))
-            col = int(match.group(2))
-            ext = match.group(3).lower()
+def tile_assets_current():
+    """True if levels and WebP copies were derived by the current DERIVE_VERSION"""
+    conn = get_db_connection()
+    try:
+        result = conn.execute("SELECT value FROM metadata WHERE key = 'derived_version'").fetchone()
+    finally:
+        release_db_connection(conn)
+    return result is not None and result[0] == str(DERIVE_VERSION)
 
-            # Read image dimensions and data
-            try:
-                with Image.open(filepath) as img:
-                    width, height = img.size
+def derive_tile_assets():
+    """Generate pyramid levels and WebP copies for every tile in the database"""
+    global _meta_cache
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT row, col, extension, is_preview, filepath FROM tiles")
+        tiles = cursor.fetchall()
+
+        def derive(tile):
+            row, col, ext, is_preview, filepath = tile
+            levels = [] if is_preview else generate_tile_levels(row, col, ext, filepath)
+            webp_path = generate_webp(filepath) if ext == 'png' else None
+            return levels, webp_path
+
+        # PIL releases the GIL while resizing and encoding; committing per
+        # batch lets deeper levels become servable while the rest catch up
+        with ThreadPoolExecutor() as executor:
+            for start in range(0, len(tiles), DERIVE_BATCH_SIZE):
+                batch = tiles[start:start + DERIVE_BATCH_SIZE]
+                results = list(executor.map(derive, batch))
+
+                cursor.executemany(
+                    "UPDATE tiles SET webp_filepath = ? WHERE row = ? AND col = ? AND is_preview = ?",
+                    [(webp_path, row, col, is_preview)
+                     for (row, col, _, is_preview, _), (_, webp_path) in zip(batch, results)]
+                )
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO tile_levels (level, row, col, extension, width, height, filepath)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [level_row for levels, _ in results for level_row in levels])
+                conn.commit()
 
-                with open(filepath, 'rb') as f:
-                    image_data = f.read()
+                # Drop lookups cached before the WebP path was known
+                for row, col, _, is_preview, _ in batch:
+                    tile_cache.invalidate(f"{'preview' if is_preview else 'high'}_{row}_{col}")
+
+        # Publish the deepest level now that it exists, and record the pass
+        # as complete so later starts skip it
+        meta = store_tiles_meta(cursor)
+        cursor.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('derived_version', ?)", (str(DERIVE_VERSION),))
+        conn.commit()
+        _meta_cache = meta
+        print(f"✓ Derived pyramid levels and WebP copies for {len(tiles)} tiles")
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error deriving tile levels and WebP copies: {e}")
+    finally:
+        release_db_connection(conn)
 
-                # Update database
-                conn = get_db_connection()
-                cursor = conn.cursor()
+def start_tile_deriver():
+    """Start the background pass that builds levels and WebP copies off the startup path"""
+    deriver = threading.Thread(target=derive_tile_assets, daemon=True)
+    deriver.start()
+    return deriver
 
-                cursor.execute('''
-                    INSERT OR REPLACE INTO tiles (row, col, extension, is_preview, width, height, filepath, image_data)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (row, col, ext, 1 if is_preview else 0, width, height, filepath, image_data))
+# File watcher for automatic tile updates
+class TileFileHandler(PatternMatchingEventHandler):
+    """Watch for new or modified tiles and update database"""
 
-                conn.commit()
-                release_db_connection(conn)
+    # Quiet period after the last event before a tile is processed
+    DEBOUNCE_SECONDS = 0.5
 
-                # Invalidate cache for this tile
-                cache_key = f"{'preview' if is_preview else 'high'}_{row}_{col}"
-                tile_cache.cache.pop(cache_key, None)
+    def __init__(self):
+        super().__init__(patterns=[f'*.{ext}' for ext in TILE_EXTENSIONS], ignore_directories=True)
+        # Pending tiles, oldest deadline first: every deadline is now + DEBOUNCE_SECONDS,
+        # so moving a re-scheduled tile to the end keeps the order
+        self.pending = OrderedDict()
+        self.pending_changed = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        threading.Thread(target=self.debounce_loop, daemon=True).start()
 
-                # Clear metadata cache to force refresh
-                global _meta_cache
-                _meta_cache = None
+    def process_tile(self, filepath, is_preview):
+        """Process a single tile file and queue its database update"""
+        filename = os.path.basename(filepath)
+        parsed = parse_tile_filename(filename, is_preview)
 
-                print(f"✓ Updated tile in database: {filename}")
+        if not parsed:
+            return
 
-            except Exception as e:
-                print(f"✗ Error processing {filename}: {e}")
+        row, col, ext = parsed
 
-        finally:
-            with self.lock:
-                self.processing.discard(filepath)
+        # Read image dimensions
+        try:
+            width, height = read_image_size(filepath, ext)
+
+            webp_path = generate_webp(filepath) if ext == 'png' else None
+
+            # Regenerate the pyramid levels for high-res tiles
+            level_rows = [] if is_preview else generate_tile_levels(row, col, ext, filepath)
+
+            # Hand the rows to the database writer thread
+            tile_row = (row, col, ext, 1 if is_preview else 0, width, height, filepath, webp_path)
+            _tile_write_q.put((tile_row, level_rows))
+
+        except Exception as e:
+            print(f"✗ Error processing {filename}: {e}")
+
+    def schedule_tile(self, filepath, is_preview):
+        """Push back a tile's deadline so only its last event is processed"""
+        with self.pending_changed:
+            was_idle = not self.pending
+            self.pending[filepath] = (time.monotonic() + self.DEBOUNCE_SECONDS, is_preview)
+            self.pending.move_to_end(filepath)
+            # Later tiles never settle before the current head, so the loop
+            # only needs waking when it is idle
+            if was_idle:
+                self.pending_changed.notify()
+
+    def debounce_loop(self):
+        """Single thread handing settled tiles to the worker pool"""
+        while True:
+            with self.pending_changed:
+                while not self.pending:
+                    self.pending_changed.wait()
+
+                settled = []
+                now = time.monotonic()
+                while self.pending:
+                    filepath, (deadline, is_preview) = next(iter(self.pending.items()))
+                    if deadline > now:
+                        break
+                    self.pending.popitem(last=False)
+                    settled.append((filepath, is_preview))
+
+                if not settled:
+                    self.pending_changed.wait(deadline - now)
+                    continue
+
+            for filepath, is_preview in settled:
+                if os.path.exists(filepath):
+                    self.executor.submit(self.process_tile, filepath, is_preview)
 
     def on_created(self, event):
         """Handle new file creation"""
-        if event.is_directory:
-            return
-
         filepath = event.src_path
         is_preview = PREVIEW_DIR in filepath
-
-        # Small delay to ensure file is fully written
-        time.sleep(0.5)
-
-        if os.path.exists(filepath):
-            threading.Thread(target=self.process_tile, args=(filepath, is_preview), daemon=True).start()
+        self.schedule_tile(filepath, is_preview)
 
     def on_modified(self, event):
         """Handle file modification"""
@@ -322,16 +675,108 @@ def start_file_watcher():
     observer.start()
     return observer
 
+# Background writer for watcher tile updates
+def _tile_db_writer():
+    """Commit queued tile updates in batches over one dedicated connection"""
+    global _meta_cache
+    conn = get_db_connection()
+
+    while True:
+        # Collect a burst: up to the batch size, or whatever arrives within the window
+        batch = [_tile_write_q.get()]
+        deadline = time.monotonic() + TILE_WRITE_BATCH_SECONDS
+        while len(batch) < TILE_WRITE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_tile_write_q.get(timeout=remaining))
+            except Empty:
+                break
+
+        try:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT OR REPLACE INTO tiles (row, col, extension, is_preview, width, height, filepath, webp_filepath)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [tile_row for tile_row, _ in batch])
+            cursor.executemany('''
+                INSERT OR REPLACE INTO tile_levels (level, row, col, extension, width, height, filepath)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [level_row for _, level_rows in batch for level_row in level_rows])
+
+            # Refresh the precomputed metadata row alongside the tiles
+            bump_tile_version(cursor)
+            meta = store_tiles_meta(cursor)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"✗ Error writing {len(batch)} tile(s) to database: {e}")
+            continue
+
+        for (row, col, _, is_preview, _, _, filepath, _), level_rows in batch:
+            # Invalidate cache for this tile
+            tile_cache.invalidate(f"{'preview' if is_preview else 'high'}_{row}_{col}")
+            for level, *_ in level_rows:
+                tile_cache.invalidate(f"level{level}_{row}_{col}")
+
+            print(f"✓ Updated tile in database: {os.path.basename(filepath)}")
+
+        # Swap in the refreshed metadata
+        _meta_cache = meta
+
+def start_tile_db_writer():
+    """Start the single thread that writes watcher updates to the database"""
+    writer = threading.Thread(target=_tile_db_writer, daemon=True)
+    writer.start()
+    return writer
+
+# Background writer for view data
+def _view_data_writer():
+    """Drain queued view-data lines into the JSONL file until the None sentinel"""
+    with open(VIEW_DATA_FILE, 'ab') as f:
+        while True:
+            line = _view_q.get()
+            if line is None:
+                return  # Everything queued before the sentinel is written; closing flushes
+            f.write(line)
+            # Flush once the burst is drained so lines land promptly
+            if _view_q.empty():
+                f.flush()
+
+def stop_view_data_writer(writer):
+    """Write out queued view data before the process exits"""
+    _view_q.put(None)
+    writer.join(timeout=5)
+
+def start_view_data_writer():
+    """Start the single thread that owns the view-data file handle"""
+    writer = threading.Thread(target=_view_data_writer, daemon=True)
+    writer.start()
+    # Daemon threads are killed at exit, so drain the queue first
+    atexit.register(stop_view_data_writer, writer)
+    return writer
+
 # Initialize database on startup
 init_db()
 scan_and_cache_tiles()
 
-# Start file watcher in background
+# Start tile database writer and file watcher in background
+tile_db_writer = start_tile_db_writer()
 file_observer = start_file_watcher()
 
+# Start view-data writer in background
+view_data_writer = start_view_data_writer()
+
+# Build pyramid levels and WebP copies in background for new databases and
+# for ones scanned before the current derived assets existed
+if not tile_assets_current():
+    tile_deriver = start_tile_deriver()
+
 @app.route('/api/images', methods=['GET'])
 def get_images():
-    images = os.listdir(IMAGE_DIR)
+    with os.scandir(IMAGE_DIR) as entries:
+        images = [entry.name for entry in entries if entry.is_file()]
     return jsonify(images)
 
 @app.route('/images/<filename>', methods=['GET'])
@@ -343,155 +788,139 @@ _meta_cache = None
 
 @app.route('/api/tiles/meta', methods=['GET'])
 def get_tiles_meta():
-    """Get tile metadata from database - ultra-fast with caching"""
+    """Get tile metadata precomputed at scan time - one row lookup, then cached"""
     global _meta_cache
 
     if _meta_cache is not None:
         return jsonify(_meta_cache)
 
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        conn = get_db_connection(readonly=True)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT value FROM metadata WHERE key = 'meta_json'")
+            result = cursor.fetchone()
+        finally:
+            release_db_connection(conn, readonly=True)
 
-        # Get tile dimensions from metadata
-        cursor.execute("SELECT value FROM metadata WHERE key = 'tile_width'")
-        tile_width = int(cursor.fetchone()[0])
-
-        cursor.execute("SELECT value FROM metadata WHERE key = 'tile_height'")
-        tile_height = int(cursor.fetchone()[0])
-
-        cursor.execute("SELECT value FROM metadata WHERE key = 'preview_width'")
-        preview_width_result = cursor.fetchone()
-        preview_width = int(preview_width_result[0]) if preview_width_result else 128
-
-        cursor.execute("SELECT value FROM metadata WHERE key = 'preview_height'")
-        preview_height_result = cursor.fetchone()
-        preview_height = int(preview_height_result[0]) if preview_height_result else 128
-
-        # Get row/col ranges for high-res tiles
-        cursor.execute("SELECT MIN(row), MAX(row), MIN(col), MAX(col) FROM tiles WHERE is_preview = 0")
-        min_row, max_row, min_col, max_col = cursor.fetchone()
-
-        # Get unique extensions
-        cursor.execute("SELECT DISTINCT extension FROM tiles WHERE is_preview = 0")
-        extensions = [row[0] for row in cursor.fetchall()]
-
-        # Check if preview tiles exist
-        cursor.execute("SELECT COUNT(*) FROM tiles WHERE is_preview = 1")
-        has_preview = cursor.fetchone()[0] > 0
-
-        # Get preview extensions
-        cursor.execute("SELECT DISTINCT extension FROM tiles WHERE is_preview = 1")
-        preview_extensions = [row[0] for row in cursor.fetchall()]
-
-        conn.close()
-
-        # Calculate center
-        center_row = (min_row + max_row) // 2
-        center_col = (min_col + max_col) // 2
-
-        response = {
-            'minRow': min_row,
-            'maxRow': max_row,
-            'minCol': min_col,
-            'maxCol': max_col,
-            'tileWidth': tile_width,
-            'tileHeight': tile_height,
-            'extensions': extensions,
-            'centerRow': center_row,
-            'centerCol': center_col,
-            'hasPreview': has_preview,
-            'previewWidth': preview_width,
-            'previewHeight': preview_height,
-            'previewExtensions': preview_extensions
-        }
+        if result:
+            response = json.loads(result[0])
+        else:
+            # Database scanned before meta_json existed; compute it once
+            conn = get_db_connection()
+            try:
+                response = store_tiles_meta(conn.cursor())
+                conn.commit()
+            finally:
+                release_db_connection(conn)
+
+        if response is None:
+            return jsonify({'error': 'No tiles found'}), 404
 
         _meta_cache = response
         return jsonify(response)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/tiles/<int:r>/<int:c>', methods=['GET'])
-def get_tile(r, c):
-    """Serve high-res tile with LRU caching - ultra-fast"""
-    try:
-        cache_key = f"high_{r}_{c}"
+def _lookup_tile(cache_key, query, params):
+    """Fetch a tile's database row through the LRU cache, or None if missing"""
+    cached = tile_cache.get(cache_key)
+    if not cached:
+        conn = get_db_connection(readonly=True)
+        try:
+            cached = conn.execute(query, params).fetchone()
+        finally:
+            release_db_connection(conn, readonly=True)
 
-        # Check cache first
-        cached = tile_cache.get(cache_key)
         if cached:
-            image_data, ext = cached
-            return send_file(
-                BytesIO(image_data),
-                mimetype=f'image/{ext}',
-                as_attachment=False,
-                download_name=f'r{r:03d}_c{c:03d}.{ext}'
-            )
-
-        # Query database
-        conn = get_db_connection()
-        cursor = conn.cursor()
+            tile_cache.put(cache_key, cached)
+    return cached
+
+def _send_tile(filepath, ext, download_name, vary_accept=False):
+    """Send a tile file with long-lived immutable caching"""
+    # Serving from a path lets the WSGI server use sendfile and answer
+    # conditional requests with a 304 before any bytes are read
+    response = send_file(
+        filepath,
+        mimetype=f'image/{ext}',
+        as_attachment=False,
+        download_name=f'{download_name}.{ext}',
+        conditional=True,
+        etag=True,
+        max_age=TILE_MAX_AGE
+    )
+
+    # Let browsers and CDNs reuse the tile without revalidating
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if vary_accept:
+        response.vary.add('Accept')
+    return response
+
+def _send_negotiated_tile(cached, download_name):
+    """Send a tile row, preferring the smaller WebP copy when the client accepts it"""
+    filepath, ext, webp_filepath = cached
+    if webp_filepath and 'image/webp' in request.headers.get('Accept', ''):
+        filepath, ext = webp_filepath, 'webp'
+    # Always vary on Accept, as nginx does for these URLs, since a WebP copy
+    # may appear after a response has been cached
+    return _send_tile(filepath, ext, download_name, vary_accept=True)
 
-        cursor.execute("SELECT image_data, extension FROM tiles WHERE row = ? AND col = ? AND is_preview = 0", (r, c))
-        result = cursor.fetchone()
-        release_db_connection(conn)
-
-        if result:
-            image_data, ext = result
-
-            # Store in cache
-            tile_cache.put(cache_key, (image_data, ext))
-
-            return send_file(
-                BytesIO(image_data),
-                mimetype=f'image/{ext}',
-                as_attachment=False,
-                download_name=f'r{r:03d}_c{c:03d}.{ext}'
-            )
+@app.route('/api/tiles/<int:r>/<int:c>', methods=['GET'])
+def get_tile(r, c):
+    """Serve high-res tile straight from disk with LRU caching of the lookup"""
+    try:
+        cached = _lookup_tile(
+            f"high_{r}_{c}",
+            "SELECT filepath, extension, webp_filepath FROM tiles WHERE row = ? AND col = ? AND is_preview = 0",
+            (r, c)
+        )
+        if not cached:
+            return jsonify({'error': 'Tile not found'}), 404
 
+        return _send_negotiated_tile(cached, f'r{r:03d}_c{c:03d}')
+    except FileNotFoundError:
         return jsonify({'error': 'Tile not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/tiles/preview/<int:r>/<int:c>', methods=['GET'])
 def get_preview_tile(r, c):
-    """Serve preview tile with LRU caching - ultra-fast"""
+    """Serve preview tile straight from disk with LRU caching of the lookup"""
     try:
-        cache_key = f"preview_{r}_{c}"
-
-        # Check cache first
-        cached = tile_cache.get(cache_key)
-        if cached:
-            image_data, ext = cached
-            return send_file(
-                BytesIO(image_data),
-                mimetype=f'image/{ext}',
-                as_attachment=False,
-                download_name=f'r{r:03d}_c{c:03d}_preview.{ext}'
-            )
-
-        # Query database
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT image_data, extension FROM tiles WHERE row = ? AND col = ? AND is_preview = 1", (r, c))
-        result = cursor.fetchone()
-        release_db_connection(conn)
+        cached = _lookup_tile(
+            f"preview_{r}_{c}",
+            "SELECT filepath, extension, webp_filepath FROM tiles WHERE row = ? AND col = ? AND is_preview = 1",
+            (r, c)
+        )
+        if not cached:
+            return jsonify({'error': 'Preview tile not found'}), 404
 
-        if result:
-            image_data, ext = result
+        return _send_negotiated_tile(cached, f'r{r:03d}_c{c:03d}_preview')
+    except FileNotFoundError:
+        return jsonify({'error': 'Preview tile not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-            # Store in cache
-            tile_cache.put(cache_key, (image_data, ext))
+@app.route('/api/tiles/<int:level>/<int:r>/<int:c>', methods=['GET'])
+def get_level_tile(level, r, c):
+    """Serve a tile from the pyramid; level 0 is full resolution"""
+    if level == 0:
+        return get_tile(r, c)
 
-            return send_file(
-                BytesIO(image_data),
-                mimetype=f'image/{ext}',
-                as_attachment=False,
-                download_name=f'r{r:03d}_c{c:03d}_preview.{ext}'
-            )
+    try:
+        cached = _lookup_tile(
+            f"level{level}_{r}_{c}",
+            "SELECT filepath, extension FROM tile_levels WHERE level = ? AND row = ? AND col = ?",
+            (level, r, c)
+        )
+        if not cached:
+            return jsonify({'error': 'Tile not found'}), 404
 
-        return jsonify({'error': 'Preview tile not found'}), 404
+        filepath, ext = cached
+        return _send_tile(filepath, ext, f'r{r:03d}_c{c:03d}_l{level}')
+    except FileNotFoundError:
+        return jsonify({'error': 'Tile not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -503,18 +932,8 @@ def collect_view_data():
         # Add server timestamp
         data['server_timestamp'] = datetime.now().isoformat()
 
-        # Load existing data or create new list
-        view_history = []
-        if os.path.exists(VIEW_DATA_FILE):
-            with open(VIEW_DATA_FILE, 'r') as f:
-                view_history = json.load(f)
-
-        # Append new data
-        view_history.append(data)
-
-        # Save updated data
-        with open(VIEW_DATA_FILE, 'w') as f:
-            json.dump(view_history, f, indent=2)
+        # Hand the encoded line to the writer thread; no disk I/O on the request path
+        _view_q.put(orjson.dumps(data) + b'\n')
 
         return jsonify({'status': 'success', 'message': 'View data saved'}), 200
     except Exception as e:
@@ -5,50 +5,86 @@ WMTS layer downloader + stitcher (works with NASA Trek).
 Features
 - Parses GetCapabilities to discover Style, TileMatrixSet, TileMatrix.
 - Uses ResourceURL template when available (REST), otherwise falls back to KVP.
-- Concurrent tile downloads with retry/backoff.
+- Concurrent tile downloads over a shared HTTP/2 connection with retry/backoff.
+- Downloaded tiles are cached on disk so reruns skip the network (--no-cache).
 - Optional tile subrange (--tile-range colMin:colMax,rowMin:rowMax).
 - Stitches to one image (PNG or JPG). Missing tiles are filled.
+- Or (--split-dir) writes backend tiles + previews directly, without a mosaic.
 
-Requirements: requests, Pillow, tqdm
-  pip install requests pillow tqdm
+Requirements: httpx (with HTTP/2 extra), lxml, NumPy, Pillow (or the drop-in pillow-simd), tqdm
+  pip install "httpx[http2]" lxml numpy pillow tqdm
+Optional: imagecodecs (faster JPEG/PNG tile decoding)
 """
 
 import argparse
 import concurrent.futures as futures
 import math
 import os
+import random
 import re
 import sys
 import tempfile
+import threading
 import time
 import urllib.parse
-import xml.etree.ElementTree as ET
 from io import BytesIO
 
-import requests
-from PIL import Image
+import httpx
+import numpy as np
+from lxml import etree
+from PIL import Image, ImageFilter
 from tqdm import tqdm
 
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
+
 NS = {
     "wmts": "http://www.opengis.net/wmts/1.0",
     "ows": "http://www.opengis.net/ows/1.1",
     "xlink": "http://www.w3.org/1999/xlink"
 }
 
-def fetch_text(url, timeout=30):
-    r = requests.get(url, timeout=timeout)
+# XPath expressions compiled once and reused for every capabilities node
+_XP_LAYERS = etree.XPath(".//wmts:Contents/wmts:Layer", namespaces=NS)
+_XP_TMS = etree.XPath(".//wmts:Contents/wmts:TileMatrixSet", namespaces=NS)
+_XP_TM = etree.XPath("wmts:TileMatrix", namespaces=NS)
+_XP_IDENT = etree.XPath("string(ows:Identifier)", namespaces=NS)
+_XP_FORMATS = etree.XPath("wmts:Format/text()", namespaces=NS)
+_XP_STYLES = etree.XPath("wmts:Style", namespaces=NS)
+_XP_TMS_LINK = etree.XPath("wmts:TileMatrixSetLink/wmts:TileMatrixSet/text()", namespaces=NS)
+_XP_RES = etree.XPath("wmts:ResourceURL[@resourceType='tile'][@template]", namespaces=NS)
+# Identifier, TileWidth, TileHeight, MatrixWidth, MatrixHeight of one TileMatrix
+_XP_TM_FIELDS = etree.XPath(
+    "(ows:Identifier | wmts:TileWidth | wmts:TileHeight | wmts:MatrixWidth | wmts:MatrixHeight)",
+    namespaces=NS,
+)
+_TM_FIELD_TAGS = {
+    "{%s}Identifier" % NS["ows"]: "id",
+    "{%s}TileWidth" % NS["wmts"]: "tile_width",
+    "{%s}TileHeight" % NS["wmts"]: "tile_height",
+    "{%s}MatrixWidth" % NS["wmts"]: "matrix_width",
+    "{%s}MatrixHeight" % NS["wmts"]: "matrix_height",
+}
+
+def fetch_bytes(client, url, timeout=30):
+    r = client.get(url, timeout=timeout)
     r.raise_for_status()
-    return r.text
+    return r.content
+
+# C parser; huge_tree lifts libxml2's size limits for multi-MB capabilities
+CAPS_PARSER = etree.XMLParser(huge_tree=True, collect_ids=False, remove_blank_text=True)
 
-def parse_capabilities(xml_text):
-    root = ET.fromstring(xml_text)
+# Raw bytes, so lxml decodes by the document's own encoding declaration
+def parse_capabilities(xml_bytes):
+    root = etree.fromstring(xml_bytes, CAPS_PARSER)
     return root
 
 def find_layer(root, layer_id=None):
     layers = []
-    for lyr in root.findall(".//wmts:Contents/wmts:Layer", NS):
-        ident = lyr.findtext("ows:Identifier", default="", namespaces=NS)
-        layers.append((ident, lyr))
+    for lyr in _XP_LAYERS(root):
+        layers.append((_XP_IDENT(lyr), lyr))
     if not layers:
         raise RuntimeError("No layers found in capabilities.")
     if layer_id:
@@ -60,28 +96,30 @@ def find_layer(root, layer_id=None):
     return layers[0]
 
 def layer_formats(layer_node):
-    return [fmt.text for fmt in layer_node.findall("wmts:Format", NS)]
+    return [str(fmt) for fmt in _XP_FORMATS(layer_node)]
 
 def layer_default_style(layer_node):
-    for s in layer_node.findall("wmts:Style", NS):
-        ident = s.findtext("ows:Identifier", namespaces=NS)
+    styles = _XP_STYLES(layer_node)
+    for s in styles:
         is_default = (s.attrib.get("isDefault", "").lower() == "true")
         if is_default:
-            return ident
+            return _XP_IDENT(s)
     # fallback: first style
-    s = layer_node.find("wmts:Style/ows:Identifier", NS)
-    return s.text if s is not None else "default"
+    for s in styles:
+        ident = _XP_IDENT(s)
+        if ident:
+            return ident
+    return "default"
 
 def layer_tilematrixset_id(layer_node):
-    tms = layer_node.find("wmts:TileMatrixSetLink/wmts:TileMatrixSet", NS)
-    if tms is None or not tms.text:
+    tms = _XP_TMS_LINK(layer_node)
+    if not tms or not tms[0]:
         raise RuntimeError("Layer has no TileMatrixSetLink/TileMatrixSet.")
-    return tms.text.strip()
+    return tms[0].strip()
 
 def find_tilematrixset(root, tms_id):
-    for node in root.findall(".//wmts:Contents/wmts:TileMatrixSet", NS):
-        ident = node.findtext("ows:Identifier", namespaces=NS)
-        if ident == tms_id:
+    for node in _XP_TMS(root):
+        if _XP_IDENT(node) == tms_id:
             return node
     raise RuntimeError(f"TileMatrixSet '{tms_id}' not found.")
 
@@ -90,18 +128,15 @@ def list_tilematrices(tms_node):
         # Handles "256", "256.0", "2.0" safely
         return int(float(text.strip()))
     lst = []
-    for tm in tms_node.findall("wmts:TileMatrix", NS):
-        ident = tm.findtext("ows:Identifier", namespaces=NS)
-        tile_w = to_int_like(tm.findtext("wmts:TileWidth", namespaces=NS))
-        tile_h = to_int_like(tm.findtext("wmts:TileHeight", namespaces=NS))
-        m_w = to_int_like(tm.findtext("wmts:MatrixWidth", namespaces=NS))
-        m_h = to_int_like(tm.findtext("wmts:MatrixHeight", namespaces=NS))
+    for tm in _XP_TM(tms_node):
+        # One pass over the child fields instead of a findtext per field
+        fields = {_TM_FIELD_TAGS[el.tag]: el.text for el in _XP_TM_FIELDS(tm)}
         lst.append({
-            "id": ident,                   # keep as string (some servers use "2.0")
-            "tile_width": tile_w,
-            "tile_height": tile_h,
-            "matrix_width": m_w,
-            "matrix_height": m_h
+            "id": fields["id"],            # keep as string (some servers use "2.0")
+            "tile_width": to_int_like(fields["tile_width"]),
+            "tile_height": to_int_like(fields["tile_height"]),
+            "matrix_width": to_int_like(fields["matrix_width"]),
+            "matrix_height": to_int_like(fields["matrix_height"])
         })
     return lst
 
@@ -113,12 +148,13 @@ def resourceurl_template(layer_node):
       format="image/jpeg"
       template="https://.../{Style}/{TileMatrixSet}/{TileMatrix}/{TileRow}/{TileCol}.jpg"
     """
-    for rurl in layer_node.findall("wmts:ResourceURL", NS):
-        if rurl.attrib.get("resourceType") == "tile" and "template" in rurl.attrib:
-            return rurl.attrib["template"], rurl.attrib.get("format")
+    rurls = _XP_RES(layer_node)
+    if rurls:
+        return rurls[0].attrib["template"], rurls[0].attrib.get("format")
     return None, None
 
-def make_kvp_url(base_service_url, layer_id, style, tms_id, tilematrix, row, col, out_format):
+def make_kvp_template(base_service_url, layer_id, style, tms_id, tilematrix, out_format):
+    # KVP GetTile URL with {TileRow}/{TileCol} left for fill_tile_url
     # Ensure base is a service endpoint (no prior query)
     parsed = urllib.parse.urlparse(base_service_url)
     if parsed.query:
@@ -134,15 +170,28 @@ def make_kvp_url(base_service_url, layer_id, style, tms_id, tilematrix, row, col
         "STYLE": style,
         "TILEMATRIXSET": tms_id,
         "TILEMATRIX": tilematrix,
-        "TILEROW": str(row),
-        "TILECOL": str(col),
-        "FORMAT": out_format or "image/png",
     }
-    return base + ("?" + urllib.parse.urlencode(params))
+    tail = {"FORMAT": out_format or "image/png"}
+    return (base + "?" + urllib.parse.urlencode(params)
+            + "&TILEROW={TileRow}&TILECOL={TileCol}&" + urllib.parse.urlencode(tail))
+
+def fill_tile_url(template, row, col):
+    return template.replace("{TileRow}", str(row)).replace("{TileCol}", str(col))
 
 VAR_RE = re.compile(r"\{([A-Za-z0-9]+)\}")
 
+class _KeepMissing(dict):
+    # Leave unknown placeholders (e.g. {TileRow}) in place for a later pass
+    def __missing__(self, key):
+        return "{" + key + "}"
+
 def render_rest_template(template, mapping):
+    # ResourceURL placeholders are plain {Name} str.format fields; use
+    # format_map unless some brace is not part of one (escapes, specs, ...)
+    fields = VAR_RE.findall(template)
+    if (template.count("{") == template.count("}") == len(fields)
+            and not any(f[0].isdigit() for f in fields)):
+        return template.format_map(_KeepMissing(mapping))
     def repl(m):
         key = m.group(1)
         return str(mapping.get(key, m.group(0)))
@@ -168,6 +217,58 @@ def ext_from_format(fmt):
         return "webp"
     return "png"
 
+def decode_tile(content):
+    """
+    Decode tile bytes to a uint8 array of shape (h, w, 3), or (h, w, 4) when
+    the tile carries alpha. JPEG and PNG go straight to libjpeg-turbo / libpng
+    through imagecodecs when it is installed; everything else uses Pillow.
+    """
+    arr = None
+    if imagecodecs is not None:
+        try:
+            if content[:3] == b"\xff\xd8\xff":
+                arr = imagecodecs.jpeg8_decode(content)
+                if arr.ndim == 3 and arr.shape[2] != 3:
+                    arr = None  # CMYK; let Pillow handle the colour conversion
+            elif content[:8] == b"\x89PNG\r\n\x1a\n":
+                arr = imagecodecs.png_decode(content)
+                if arr.dtype != np.uint8:
+                    arr = None  # 16-bit; let Pillow rescale it
+        except Exception:
+            arr = None
+    if arr is None:
+        img = Image.open(BytesIO(content))
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        return np.asarray(img.convert("RGBA" if has_alpha else "RGB"))
+    if arr.ndim == 2:
+        # Greyscale: broadcast the one channel to RGB without copying
+        return np.broadcast_to(arr[:, :, None], arr.shape + (3,))
+    if arr.shape[2] == 2:
+        # Greyscale + alpha
+        grey, a = arr[:, :, 0], arr[:, :, 1]
+        return np.dstack((grey, grey, grey, a))
+    return arr
+
+def save_split_tiles(arr, row0, col0, size, images_dir, previews_dir):
+    """
+    Cut one decoded WMTS tile into size x size backend tiles (rRRR_cCCC.jpg)
+    plus 1:2 previews, with the same encoder settings as split_image_improved.py.
+    """
+    h, w = arr.shape[:2]
+    # One Lanczos reduction + slight blur per WMTS tile, sliced per preview
+    preview = Image.fromarray(arr).resize((w // 2, h // 2), Image.LANCZOS)
+    preview = np.asarray(preview.filter(ImageFilter.GaussianBlur(radius=0.5)))
+    half = size // 2
+    for i in range(h // size):
+        tile_prefix = os.path.join(images_dir, f"r{row0 + i:03d}_c")
+        preview_prefix = os.path.join(previews_dir, f"r{row0 + i:03d}_c")
+        for j in range(w // size):
+            tile = arr[i * size:(i + 1) * size, j * size:(j + 1) * size]
+            Image.fromarray(tile).save(f"{tile_prefix}{col0 + j:03d}.jpg", quality=85)
+            small = preview[i * half:(i + 1) * half, j * half:(j + 1) * half]
+            Image.fromarray(small).save(f"{preview_prefix}{col0 + j:03d}_preview.jpg",
+                                        quality=75, subsampling=0)
+
 def main():
     ap = argparse.ArgumentParser(description="Download + stitch a WMTS layer (NASA Trek friendly).")
     ap.add_argument("--capabilities", required=True, help="URL to WMTSCapabilities.xml")
@@ -177,10 +278,21 @@ def main():
     ap.add_argument("--zoom", required=True, help="TileMatrix identifier to download (string, e.g., '0','5','14')")
     ap.add_argument("--tile-range", default=None,
                     help="Optional tile range: colMin:colMax,rowMin:rowMax (inclusive). Example: 0:63,0:31")
-    ap.add_argument("--out", required=True, help="Output image path (.png or .jpg)")
+    output = ap.add_mutually_exclusive_group(required=True)
+    output.add_argument("--out", help="Output image path (.png or .jpg)")
+    output.add_argument("--split-dir",
+                        help="Skip the mosaic and write backend tiles + previews straight into "
+                             "DIR/images and DIR/image_previews")
+    ap.add_argument("--split-size", type=int, default=128,
+                    help="Backend tile size for --split-dir (default 128; must divide the WMTS tile size)")
     ap.add_argument("--max-workers", type=int, default=8, help="Concurrent downloads (default 8)")
     ap.add_argument("--retries", type=int, default=3, help="Retries per tile (default 3)")
     ap.add_argument("--delay", type=float, default=0.0, help="Delay seconds between requests (politeness)")
+    ap.add_argument("--max-tiles", type=int, default=100000,
+                    help="Refuse to download more tiles than this; use --tile-range to narrow (default 100000, 0 = no limit)")
+    ap.add_argument("--cache-dir", default=os.path.join(os.path.expanduser("~"), ".cache", "wmts"),
+                    help="Directory for downloaded tiles, reused by later runs (default ~/.cache/wmts)")
+    ap.add_argument("--no-cache", action="store_true", help="Always download; do not read or write the tile cache")
     ap.add_argument("--user-agent", default="wmts-stitcher/1.0", help="HTTP User-Agent")
     args = ap.parse_args()
     
@@ -188,12 +300,29 @@ def main():
     print(f"Capabilities URL: {args.capabilities}")
     print(f"Layer: {args.layer}")
     print(f"Zoom: {args.zoom}")
-    print(f"Output: {args.out}")
+    print(f"Output: {args.out or args.split_dir}")
+
+    # One HTTP/2 client shared by the capabilities fetch and all workers:
+    # requests are multiplexed as streams over a pooled keep-alive TLS
+    # connection instead of a fresh handshake per request
+    timeout = 60
+    headers = {"User-Agent": args.user_agent}
+    session = httpx.Client(
+        http2=True,
+        headers=headers,
+        timeout=timeout,
+        follow_redirects=True,
+        limits=httpx.Limits(
+            max_connections=args.max_workers,
+            max_keepalive_connections=args.max_workers,
+            keepalive_expiry=timeout,
+        ),
+    )
 
     # Get capabilities
     print("Fetching capabilities document...")
-    caps_xml = fetch_text(args.capabilities)
-    print(f"Capabilities document size: {len(caps_xml)} characters")
+    caps_xml = fetch_bytes(session, args.capabilities)
+    print(f"Capabilities document size: {len(caps_xml)} bytes")
     root = parse_capabilities(caps_xml)
     print("Capabilities document parsed successfully")
 
@@ -233,28 +362,29 @@ def main():
 
     # If output path lacks extension, add one based on format
     out_path = args.out
-    if not os.path.splitext(out_path)[1]:
+    if out_path and not os.path.splitext(out_path)[1]:
         out_path = out_path + f".{out_ext}"
 
     # Build URL generator
-    headers = {"User-Agent": args.user_agent}
     base_service = detect_base_service_url(args.capabilities)
 
+    # Only TileRow/TileCol change between tiles, so render everything else
+    # into the template once and fill the two placeholders per tile
+    if rest_template:
+        mapping = {
+            "Style": style,
+            "TileMatrixSet": tms_id,
+            "TileMatrix": args.zoom,
+            # Some templates also include Layer or layer in the path:
+            "Layer": layer_id,
+            "layer": layer_id,
+        }
+        url_template = render_rest_template(rest_template, mapping)
+    else:
+        url_template = make_kvp_template(base_service, layer_id, style, tms_id, args.zoom, out_mime)
+
     def tile_url(col, row):
-        if rest_template:
-            mapping = {
-                "Style": style,
-                "TileMatrixSet": tms_id,
-                "TileMatrix": args.zoom,
-                "TileRow": row,
-                "TileCol": col,
-                # Some templates also include Layer or layer in the path:
-                "Layer": layer_id,
-                "layer": layer_id,
-            }
-            return render_rest_template(rest_template, mapping)
-        else:
-            return make_kvp_url(base_service, layer_id, style, tms_id, args.zoom, row, col, out_mime)
+        return fill_tile_url(url_template, row, col)
 
     # Parse optional tile range
     col_min, col_max = 0, mat_w - 1
@@ -271,31 +401,57 @@ def main():
         except Exception as e:
             raise RuntimeError(f"Invalid --tile-range. Expected colMin:colMax,rowMin:rowMax. Got: {args.tile_range}") from e
 
-    # Make temp cache dir
-    cache = tempfile.mkdtemp(prefix="wmts_tiles_")
-
-    session = requests.Session()
-    session.headers.update(headers)
-    timeout = 60
+    # Persistent tile cache keyed by server, layer, style, TileMatrixSet and
+    # zoom, sharded by row so no single directory holds the whole matrix
+    cache_dir = None
+    if not args.no_cache:
+        key = (urllib.parse.urlparse(args.capabilities).netloc, layer_id, style, tms_id, args.zoom)
+        cache_dir = os.path.join(args.cache_dir, *(urllib.parse.quote(str(k), safe="") for k in key))
+        print(f"Tile cache: {cache_dir}")
+
+    # Retry policy: honour Retry-After on 429 (capped so a hostile or broken
+    # server can't stall a worker indefinitely), exponential backoff with
+    # jitter on 5xx / transport errors, give up at once on other 4xx.
+    # 401/403 means every tile will fail, so stop issuing requests
+    backoff_base = 0.5
+    retry_after_max = 60.0
+    access_denied = threading.Event()
+
+    def backoff(attempt):
+        return backoff_base * 2 ** attempt + random.uniform(0, backoff_base)
+
+    def retry_after(r, attempt):
+        try:
+            return min(retry_after_max, max(0.0, float(r.headers.get("Retry-After"))))
+        except (TypeError, ValueError):
+            return backoff(attempt)
 
     def fetch_tile(col, row):
         url = tile_url(col, row)
-        attempt = 0
-        while attempt < args.retries:
+        for attempt in range(args.retries):
+            if access_denied.is_set():
+                return None
             try:
                 if args.delay > 0:
                     time.sleep(args.delay)
-                r = session.get(url, timeout=timeout)
+                r = session.get(url)
+            except httpx.HTTPError:
+                wait = backoff(attempt)
+            else:
                 if r.status_code == 200:
                     return r.content
-                elif r.status_code in (404, 204):
-                    return None  # missing tile
+                if r.status_code == 429:
+                    wait = retry_after(r, attempt)
+                elif r.status_code >= 500:
+                    wait = backoff(attempt)
                 else:
-                    attempt += 1
-                    time.sleep(0.5 * (attempt ** 2))
-            except requests.RequestException:
-                attempt += 1
-                time.sleep(0.5 * (attempt ** 2))
+                    if r.status_code in (401, 403) and not access_denied.is_set():
+                        access_denied.set()
+                        print(f"Access denied (HTTP {r.status_code}) for {url}; skipping remaining tiles")
+                    return None  # missing tile (404/204) or client error
+            # No point waiting after the last attempt
+            if attempt < args.retries - 1:
+                time.sleep(wait)
         return None
 
     # Prepare canvas
@@ -303,47 +459,140 @@ def main():
     rows = row_max - row_min + 1
     canvas_w = cols * tile_w
     canvas_h = rows * tile_h
-    # Use RGBA so we can fill holes nicely
-    mosaic = Image.new("RGBA", (canvas_w, canvas_h), (240, 240, 240, 255))
+    total_tiles = cols * rows
+    if args.max_tiles and total_tiles > args.max_tiles:
+        raise RuntimeError(f"{total_tiles} tiles requested ({cols} x {rows}), more than --max-tiles {args.max_tiles}. "
+                           "Narrow it with --tile-range or raise --max-tiles.")
+
+    if args.split_dir:
+        # Cut each WMTS tile into backend tiles as it arrives; no mosaic
+        size = args.split_size
+        if size < 2 or size % 2 or tile_w % size or tile_h % size:
+            raise RuntimeError(f"--split-size {size} must be even and divide the {tile_w}x{tile_h} WMTS tiles.")
+        images_dir = os.path.join(args.split_dir, "images")
+        previews_dir = os.path.join(args.split_dir, "image_previews")
+        os.makedirs(images_dir, exist_ok=True)
+        os.makedirs(previews_dir, exist_ok=True)
+    else:
+        # Opaque RGB canvas preallocated as an array; workers decode their tile
+        # and assign it into its own disjoint block. An alpha plane is only
+        # allocated once a tile with transparent pixels turns up
+        canvas = np.full((canvas_h, canvas_w, 3), 240, dtype=np.uint8)
+    alpha = None
+    alpha_lock = threading.Lock()
+
+    def split_tile(col, row, content):
+        # Same fill colour as the mosaic for missing, bad or short tiles
+        block = np.full((tile_h, tile_w, 3), 240, dtype=np.uint8)
+        if content:
+            try:
+                arr = decode_tile(content)[:tile_h, :tile_w]
+                block[:arr.shape[0], :arr.shape[1]] = arr[:, :, :3]
+            except Exception:
+                pass
+        save_split_tiles(block, (row - row_min) * (tile_h // size), (col - col_min) * (tile_w // size),
+                         size, images_dir, previews_dir)
+
+    def paste_tile(col, row, content):
+        nonlocal alpha
+        try:
+            arr = decode_tile(content)
+        except Exception:
+            # Bad content; leave as fill
+            return
+        arr = arr[:tile_h, :tile_w]
+        h, w = arr.shape[:2]
+        x = (col - col_min) * tile_w
+        y = (row - row_min) * tile_h
+        canvas[y:y + h, x:x + w] = arr[:, :, :3]
+        if arr.shape[2] == 4 and arr[:, :, 3].min() < 255:
+            with alpha_lock:
+                if alpha is None:
+                    alpha = np.full((canvas_h, canvas_w), 255, dtype=np.uint8)
+            alpha[y:y + h, x:x + w] = arr[:, :, 3]
+
+    def load_tile(col, row):
+        if cache_dir is None:
+            return fetch_tile(col, row)
+        path = os.path.join(cache_dir, str(row), f"{col}.{out_ext}")
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        content = fetch_tile(col, row)
+        if content:
+            tmp_path = None
+            try:
+                # Write-then-rename so an interrupted run never leaves a torn tile
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            except OSError:
+                # Caching is best effort; just don't leave the partial file behind
+                if tmp_path is not None:
+                    try:
+                        os.unlink(tmp_path)
+                    except OSError:
+                        pass
+        return content
+
+    def fetch_and_paste(col, row):
+        content = load_tile(col, row)
+        if args.split_dir:
+            split_tile(col, row, content)
+        elif content:
+            paste_tile(col, row, content)
+        # else: missing -> leave fill
 
     # Download concurrently
-    tasks = []
-    for r in range(row_min, row_max + 1):
-        for c in range(col_min, col_max + 1):
-            tasks.append((c, r))
+    tasks = ((c, r) for r in range(row_min, row_max + 1) for c in range(col_min, col_max + 1))
 
     with futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
-        pbar = tqdm(total=len(tasks), desc="Downloading tiles", unit="tile")
-        future_map = {executor.submit(fetch_tile, c, r): (c, r) for (c, r) in tasks}
-        for fut in futures.as_completed(future_map):
-            c, r = future_map[fut]
-            content = fut.result()
-            if content:
-                try:
-                    img = Image.open(BytesIO(content)).convert("RGBA")
-                except Exception:
-                    # Bad content; leave as fill
-                    img = None
-                if img:
-                    x = (c - col_min) * tile_w
-                    y = (r - row_min) * tile_h
-                    mosaic.paste(img, (x, y))
-            # else: missing -> leave fill
+        pbar = tqdm(total=total_tiles, desc="Downloading tiles", unit="tile")
+        # Submit lazily with a bounded window of in-flight tiles instead of
+        # creating a Future for every tile up front
+        max_pending = args.max_workers * 4
+        pending = set()
+        for c, r in tasks:
+            if len(pending) >= max_pending:
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for fut in done:
+                    fut.result()
+                    pbar.update(1)
+            pending.add(executor.submit(fetch_and_paste, c, r))
+        for fut in futures.as_completed(pending):
+            fut.result()
             pbar.update(1)
         pbar.close()
+    session.close()
+
+    if args.split_dir:
+        print(f"Saved {total_tiles * (tile_w // size) * (tile_h // size)} tiles + previews to: {args.split_dir}")
+        print(f"Layer={layer_id}, Style={style}, TMS={tms_id}, TileMatrix={args.zoom}, Tiles={total_tiles}")
+        return
+
+    if alpha is None:
+        mosaic = Image.fromarray(canvas)
+    else:
+        mosaic = Image.fromarray(np.dstack((canvas, alpha)))
 
     # Convert to output mode based on extension
     ext = os.path.splitext(out_path)[1].lower()
-    if ext in (".jpg", ".jpeg"):
+    if ext in (".jpg", ".jpeg") and mosaic.mode == "RGBA":
         # flatten RGBA onto white for JPEG
         out_img = Image.new("RGB", (canvas_w, canvas_h), (255, 255, 255))
         out_img.paste(mosaic, mask=mosaic.split()[-1])
         out_img.save(out_path, quality=92, optimize=True)
+    elif ext in (".jpg", ".jpeg"):
+        mosaic.save(out_path, quality=92, optimize=True)
     else:
         mosaic.save(out_path)
 
     print(f"Saved mosaic: {out_path}")
-    print(f"Layer={layer_id}, Style={style}, TMS={tms_id}, TileMatrix={args.zoom}, Tiles={len(tasks)}")
+    print(f"Layer={layer_id}, Style={style}, TMS={tms_id}, TileMatrix={args.zoom}, Tiles={total_tiles}")
     print(f"Canvas: {canvas_w} x {canvas_h}px ({cols} x {rows} tiles of {tile_w}x{tile_h})")
 
 
@@ -3,6 +3,8 @@ from PIL import Image
 import os
 import glob
 
+from tile_split_utils import pyvips, load_array, vips_passes, dzsave_tiles, tile_executor
+
 # Disable decompression bomb check for large images
 Image.MAX_IMAGE_PIXELS = None
 
@@ -11,13 +13,15 @@ TILE_SIZE = 128
 INPUT_DIR = ""
 OUTPUT_DIR = "../images"
 PREVIEW_DIR = "../image_previews"
+# Huffman-optimised JPEGs are ~15% smaller but 1.5-3x slower to encode
+OPTIMIZE_JPEG = False
 
 # Create output directories
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(PREVIEW_DIR, exist_ok=True)
 
 # Find all images in backend folder (not subfolders)
-image_extensions = ['*.jpg', '*.jpeg', '*.png']
+image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.tif', '*.tiff']
 image_files = []
 for ext in image_extensions:
     image_files.extend(glob.glob(os.path.join(INPUT_DIR, ext)))
@@ -27,8 +31,8 @@ if not image_files:
     exit(1)
 
 input_image = image_files[0]
-img = Image.open(input_image)
-width, height = img.size
+src = Image.open(input_image)
+width, height = src.size
 
 # Calculate number of tiles needed
 cols = (width + TILE_SIZE - 1) // TILE_SIZE  # Ceiling division
@@ -38,27 +42,41 @@ print(f"Tile size: {TILE_SIZE}x{TILE_SIZE}")
 print(f"Grid: {rows} rows x {cols} cols = {total_tiles} tiles")
 print(f"Creating tiles...")
 
-# Split the image
-for row in range(rows):
-    for col in range(cols):
-        left = col * TILE_SIZE
-        top = row * TILE_SIZE
-        right = min(left + TILE_SIZE, width)
-        bottom = min(top + TILE_SIZE, height)
+# Per-row output path prefixes, built once instead of per tile
+tile_prefixes = [os.path.join(OUTPUT_DIR, f"r{row:03d}_c") for row in range(rows)]
+preview_prefixes = [os.path.join(PREVIEW_DIR, f"r{row:03d}_c") for row in range(rows)]
 
-        # Calculate actual tile dimensions (may be smaller at edges)
-        actual_width = right - left
-        actual_height = bottom - top
+# Encode one tile (JPEG encoding releases the GIL, so tiles save in parallel)
+def save_tile(row, col):
+    left = col * TILE_SIZE
+    top = row * TILE_SIZE
+    right = min(left + TILE_SIZE, width)
+    bottom = min(top + TILE_SIZE, height)
 
-        # Crop the tile
-        tile = img.crop((left, top, right, bottom))
+    # Slice the tile (may be smaller at edges)
+    tile = Image.fromarray(arr[top:bottom, left:right])
 
-        # Save the full resolution tile
-        filename = f"r{row:03d}_c{col:03d}.jpg"
-        filepath = os.path.join(OUTPUT_DIR, filename)
-        tile.save(filepath, 'JPEG', quality=100, optimize=True)
+    # Save the full resolution tile
+    filepath = f"{tile_prefixes[row]}{col:03d}.jpg"
+    tile.save(filepath, 'JPEG', quality=100, optimize=OPTIMIZE_JPEG)
 
-        # Create and save preview (same size, lower quality JPEG)
-        preview_filename = f"r{row:03d}_c{col:03d}_preview.jpg"
-        preview_filepath = os.path.join(PREVIEW_DIR, preview_filename)
-        tile.save(preview_filepath, 'JPEG', quality=50, optimize=True)
+    # Create and save preview (same size, lower quality JPEG)
+    preview_filepath = f"{preview_prefixes[row]}{col:03d}_preview.jpg"
+    tile.save(preview_filepath, 'JPEG', quality=50, optimize=OPTIMIZE_JPEG)
+
+# Split the image
+if pyvips:
+    # libvips splits and encodes in C; full tiles and previews are two
+    # encodes of the same source (shared decode, or streamed twice if large)
+    source = vips_passes(input_image)
+    dzsave_tiles(source(), TILE_SIZE, OUTPUT_DIR, "",
+                 f"[Q=100,optimize_coding={OPTIMIZE_JPEG}]")
+    dzsave_tiles(source(), TILE_SIZE, PREVIEW_DIR, "_preview",
+                 f"[Q=50,optimize_coding={OPTIMIZE_JPEG}]")
+else:
+    # Load once into an array; each tile is then a zero-copy view of it
+    arr = load_array(input_image)
+    tasks = [(row, col) for row in range(rows) for col in range(cols)]
+    # Forked workers share the array copy-on-write (threads where fork is missing)
+    with tile_executor() as executor:
+        list(executor.map(save_tile, *zip(*tasks), chunksize=64))
@@ -3,6 +3,10 @@ from PIL import Image, ImageFilter
 import os
 import glob
 
+import numpy as np
+
+from tile_split_utils import pyvips, load_array, vips_passes, dzsave_tiles, tile_executor
+
 # Disable decompression bomb check for large images
 Image.MAX_IMAGE_PIXELS = None
 
@@ -11,13 +15,15 @@ TILE_SIZE = 128
 INPUT_DIR = ".."
 OUTPUT_DIR = "../images"
 PREVIEW_DIR = "../image_previews"
+# Huffman-optimised JPEGs are ~15% smaller but 1.5-3x slower to encode
+OPTIMIZE_JPEG = False
 
 # Create output directories
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(PREVIEW_DIR, exist_ok=True)
 
 # Find all images in backend folder (not subfolders)
-image_extensions = ['*.jpg', '*.jpeg', '*.png']
+image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.tif', '*.tiff']
 image_files = []
 for ext in image_extensions:
     image_files.extend(glob.glob(os.path.join(INPUT_DIR, ext)))
@@ -28,8 +34,8 @@ if not image_files:
 
 input_image = image_files[0]
 print(f"Processing: {input_image}")
-img = Image.open(input_image)
-width, height = img.size
+src = Image.open(input_image)
+width, height = src.size
 
 # Calculate number of tiles needed
 cols = (width + TILE_SIZE - 1) // TILE_SIZE  # Ceiling division
@@ -39,45 +45,61 @@ print(f"Tile size: {TILE_SIZE}x{TILE_SIZE}")
 print(f"Grid: {rows} rows x {cols} cols = {total_tiles} tiles")
 print(f"Creating tiles...")
 
+# Per-row output path prefixes, built once instead of per tile
+tile_prefixes = [os.path.join(OUTPUT_DIR, f"r{row:03d}_c") for row in range(rows)]
+preview_prefixes = [os.path.join(PREVIEW_DIR, f"r{row:03d}_c") for row in range(rows)]
+
+# Encode one tile (JPEG encoding releases the GIL, so tiles save in parallel)
+def save_tile(row, col):
+    left = col * TILE_SIZE
+    top = row * TILE_SIZE
+    right = min(left + TILE_SIZE, width)
+    bottom = min(top + TILE_SIZE, height)
+
+    # Slice the tile (may be smaller at edges)
+    tile = Image.fromarray(arr[top:bottom, left:right])
+
+    # Save the full resolution tile (JPG for smaller file size)
+    filepath = f"{tile_prefixes[row]}{col:03d}.jpg"
+    tile.save(filepath, quality=85, optimize=OPTIMIZE_JPEG)
+
+    # Slice the matching block of the 1:2 preview raster
+    preview = Image.fromarray(preview_arr[top // 2:bottom // 2, left // 2:right // 2])
+
+    # Save as JPG with quality settings to avoid banding
+    preview_filepath = f"{preview_prefixes[row]}{col:03d}_preview.jpg"
+    preview.save(preview_filepath, quality=75, optimize=OPTIMIZE_JPEG, subsampling=0)
+
 # Split the image
-count = 0
-for row in range(rows):
-    for col in range(cols):
-        left = col * TILE_SIZE
-        top = row * TILE_SIZE
-        right = min(left + TILE_SIZE, width)
-        bottom = min(top + TILE_SIZE, height)
-
-        # Calculate actual tile dimensions (may be smaller at edges)
-        actual_width = right - left
-        actual_height = bottom - top
-
-        # Crop the tile
-        tile = img.crop((left, top, right, bottom))
-
-        # Save the full resolution tile (JPG for smaller file size)
-        filename = f"r{row:03d}_c{col:03d}.jpg"
-        filepath = os.path.join(OUTPUT_DIR, filename)
-        tile.save(filepath, quality=85, optimize=True)
-
-        # Create and save preview (1:2 scale, keep full RGB color depth)
-        preview_width = actual_width // 2
-        preview_height = actual_height // 2
-        
-        # Use high-quality Lanczos resampling and keep RGB mode
-        preview = tile.resize((preview_width, preview_height), Image.LANCZOS)
-        
-        # Apply slight blur to hide compression artifacts
-        preview = preview.filter(ImageFilter.GaussianBlur(radius=0.5))
-        
-        # Save as JPG with quality settings to avoid banding
-        preview_filename = f"r{row:03d}_c{col:03d}_preview.jpg"
-        preview_filepath = os.path.join(PREVIEW_DIR, preview_filename)
-        preview.save(preview_filepath, quality=75, optimize=True, subsampling=0)
-        
-        count += 1
-        if count % 100 == 0:
-            print(f"Processed {count}/{total_tiles} tiles...")
+if pyvips:
+    # libvips splits, resizes and encodes in C; full tiles and previews
+    # are both built from the same source (shared decode, or streamed twice if large)
+    source = vips_passes(input_image)
+    dzsave_tiles(source(), TILE_SIZE, OUTPUT_DIR, "",
+                 f"[Q=85,optimize_coding={OPTIMIZE_JPEG}]")
 
-print(f"Done! Created {total_tiles} tiles and previews")
+    # Previews: 1:2 Lanczos reduction plus the same slight blur, over the
+    # whole image so neighbouring previews share their edge pixels
+    preview = source().resize(0.5, kernel="lanczos3").gaussblur(0.5)
+    dzsave_tiles(preview, TILE_SIZE // 2, PREVIEW_DIR, "_preview",
+                 f"[Q=75,optimize_coding={OPTIMIZE_JPEG},subsample_mode=off]")
+else:
+    # Load once into an array; each tile is then a zero-copy view of it
+    arr = load_array(input_image)
 
+    # Previews: 1:2 Lanczos reduction plus a slight blur to hide compression
+    # artifacts, done once over the whole image so neighbouring previews
+    # share their edge pixels instead of being filtered tile by tile
+    preview_img = Image.fromarray(arr).resize((width // 2, height // 2), Image.LANCZOS)
+    preview_arr = np.asarray(preview_img.filter(ImageFilter.GaussianBlur(radius=0.5)))
+
+    tasks = [(row, col) for row in range(rows) for col in range(cols)]
+    count = 0
+    # Forked workers share the array copy-on-write (threads where fork is missing)
+    with tile_executor() as executor:
+        for _ in executor.map(save_tile, *zip(*tasks), chunksize=64):
+            count += 1
+            if count % 100 == 0:
+                print(f"Processed {count}/{total_tiles} tiles...")
+
+print(f"Done! Created {total_tiles} tiles and previews")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Helpers shared by split_image.py and split_image_improved.py.
+
+Optional: pyvips (libvips) for splitting in C, tifffile for memory-mapping
+uncompressed TIFFs. Without them the scripts fall back to Pillow + NumPy.
+"""
+from PIL import Image
+import os
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import pyvips
+except ImportError:
+    pyvips = None
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+
+# Uncompressed RGB TIFFs are memory-mapped so tiles are paged in from disk
+# on demand; everything else is decoded once into an array
+def load_array(path):
+    if tifffile is not None and path.lower().endswith((".tif", ".tiff")):
+        try:
+            arr = tifffile.memmap(path, mode="r")
+        except ValueError:
+            arr = None  # compressed or tiled; not mappable
+        if arr is not None and arr.dtype == np.uint8 and arr.ndim == 3 and arr.shape[2] == 3:
+            return arr
+    with Image.open(path) as src:
+        return np.asarray(src.convert("RGB"))
+
+
+# Decoded inputs up to libvips' own disc threshold stay in memory and are
+# shared by the tile and preview passes; anything bigger would be spilled
+# to a temporary file of width x height x bands bytes, so each pass instead
+# streams the file top to bottom and pays for a second decode
+VIPS_SHARED_DECODE_MAX_BYTES = 100 * 1024 * 1024
+
+
+def load_vips(path, access="random"):
+    image = pyvips.Image.new_from_file(path, access=access)
+    if image.hasalpha():
+        image = image.extract_band(0, n=image.bands - 1)
+    return image
+
+
+# Return a callable giving the source image for each pass over it
+def vips_passes(path):
+    image = load_vips(path)
+    if image.width * image.height * image.bands <= VIPS_SHARED_DECODE_MAX_BYTES:
+        return lambda: image
+    return lambda: load_vips(path, access="sequential")
+
+
+# Write a one-level DeepZoom grid and rename it to the rRRR_cCCC tile names
+def dzsave_tiles(image, tile_size, directory, name_suffix, save_options):
+    parent = os.path.dirname(os.path.abspath(directory))
+    with tempfile.TemporaryDirectory(dir=parent) as tmp:
+        image.dzsave(os.path.join(tmp, "tiles"), tile_size=tile_size, overlap=0,
+                     depth="one", suffix=".jpg" + save_options)
+        for entry in os.scandir(os.path.join(tmp, "tiles_files", "0")):
+            col, row = entry.name[:-len(".jpg")].split("_")
+            filename = f"r{int(row):03d}_c{int(col):03d}{name_suffix}.jpg"
+            os.replace(entry.path, os.path.join(directory, filename))
+
+
+# Forked workers inherit the decoded array copy-on-write, so only
+# (row, col) crosses the process boundary; threads where fork is missing
+def tile_executor():
+    if "fork" in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                   mp_context=multiprocessing.get_context("fork"))
+    return ThreadPoolExecutor(max_workers=os.cpu_count())
@@ -18,6 +18,7 @@ type TileMeta = {
   previewWidth: number;
   previewHeight: number;
   previewExtensions: string[];
+  tileVersion?: string;
 };
 
 type Tile = {
@@ -82,7 +83,7 @@ const TileViewer: React.FC = () => {
   }, [viewportWidth, viewportHeight]);
 
   // Load a single tile (high-res or low-res) - optimized to use direct URLs
-  const loadTile = useCallback(async (row: number, col: number, type: 'high' | 'low', distance: number) => {
+  const loadTile = useCallback(async (row: number, col: number, type: 'high' | 'low', distance: number, version?: string) => {
     const key = `${type}_${row}_${col}`;
 
     // Skip if already loading OR already loaded in the map
@@ -94,7 +95,9 @@ const TileViewer: React.FC = () => {
 
     try {
       // Use direct URL instead of blob - much faster!
-      const endpoint = type === 'high' ? `/api/tiles/${row}/${col}` : `/api/tiles/preview/${row}/${col}`;
+      // Tiles are cached as immutable; the version changes whenever tiles are rewritten
+      const path = type === 'high' ? `/api/tiles/${row}/${col}` : `/api/tiles/preview/${row}/${col}`;
+      const endpoint = version ? `${path}?v=${version}` : path;
 
       // Preload the image to ensure it's in cache
       return new Promise<Tile | null>((resolve) => {
@@ -175,7 +178,7 @@ const TileViewer: React.FC = () => {
       for (let i = 0; i < tiles.length; i += BATCH_SIZE) {
         const batch = tiles.slice(i, i + BATCH_SIZE);
         const batchResults = await Promise.all(
-          batch.map(t => loadTile(t.row, t.col, type, t.distance))
+          batch.map(t => loadTile(t.row, t.col, type, t.distance, meta.tileVersion))
         );
         results.push(...batchResults);
 
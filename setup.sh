@@ -32,7 +32,7 @@ fi
 # Install dependencies
 echo "Installing dependencies..."
 python.exe -m pip install --upgrade pip
-pip install requests pillow tqdm Flask flask-cors watchdog
+pip install "httpx[http2]" lxml numpy pillow tqdm Flask flask-cors watchdog orjson
 
 cd scripts/
 